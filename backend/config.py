@@ -1,5 +1,6 @@
 """Configuration management for SQL Agent."""
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from types import SimpleNamespace
 from typing import Optional
 
 
@@ -8,6 +9,7 @@ class Settings(BaseSettings):
     
     # Database configuration
     database_url: str = "sqlite:///./sales.db"
+    schema_cache_ttl: int = 600  # seconds before table info is re-read
     
     # LLM configuration
     llm_provider: str = "openai"  # openai, anthropic, etc.
@@ -15,21 +17,42 @@ class Settings(BaseSettings):
     openai_base_url: Optional[str] = None  # For custom endpoints
     openai_model: str = "gpt-4o-mini"
     openai_temperature: float = 0.0
+    fast_sql_enabled: bool = True  # try a single structured LLM call before the full agent
+    max_agent_iters: int = 6  # tool-calling steps before the agent is stopped
+    max_agent_seconds: float = 30.0  # wall-clock budget for one agent run
+    agent_verbose: bool = False  # print every agent prompt and tool result to stdout
+    
+    # Response cache configuration
+    cache_ttl: int = 3600  # seconds a cached answer stays valid
+    cache_max_entries: int = 256
     
     # API configuration
     api_host: str = "0.0.0.0"
     api_port: int = 8000
     cors_origins: list[str] = ["http://localhost:3000", "http://localhost:5173"]
+    query_timeout: float = 120.0  # seconds before a /query request gives up
+    max_concurrent_queries: int = 8  # agent runs allowed in flight at once
+    batch_window_ms: int = 50  # how long to wait for more questions to batch
+    max_batch_size: int = 8  # questions answered per agent run (1 disables batching)
     
-    class Config:
+    model_config = SettingsConfigDict(
         # Environment variables take precedence over .env file
         # In Docker, we rely on environment variables passed from docker-compose
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-        case_sensitive = False
+        env_file=".env",
+        env_file_encoding="utf-8",
+        case_sensitive=False,
         # Pydantic Settings automatically reads from environment variables
         # Field names are converted: openai_api_key -> OPENAI_API_KEY
+        # Settings are read once at startup and never changed afterwards
+        frozen=True,
+    )
 
 
 settings = Settings()
 
+# Plain-attribute snapshot of ``settings`` for main.py, whose request
+# handlers read settings on every request. Other modules only read settings
+# while building objects at startup and use ``settings`` directly; both hold
+# the same values since Settings is frozen.
+HOT = SimpleNamespace(**settings.model_dump())
+
@@ -1,119 +1,309 @@
 """Database initialization and setup."""
+import os
 import sqlite3
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import urlparse
 from typing import Optional
-import random
 from datetime import datetime, timedelta
 
+import numpy as np
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 
-def init_database(db_path: str = "sales.db") -> None:
-    """Initialize SQLite database with sales data."""
-    # Ensure directory exists
-    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+# Applied to every pooled SQLite connection, including the agent's. WAL +
+# synchronous=NORMAL avoids an fsync per commit and lets readers run alongside
+# the writer; a 256MB mmap window and 64MB page cache let the agent's many
+# small schema and query reads skip pread() calls.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+# What a read-only connection may prepare: reads, function calls and
+# transaction control, plus the schema pragmas reflection needs. Writes, DDL,
+# ATTACH and every other pragma (including query_only=OFF) are denied.
+READ_ONLY_ACTIONS = frozenset({
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+    sqlite3.SQLITE_TRANSACTION,
+})
+READ_ONLY_PRAGMAS = frozenset({
+    "table_info", "table_xinfo", "index_list", "index_info", "index_xinfo", "foreign_key_list",
+})
+
+
+def _read_only_authorizer(action, arg1, arg2, db_name, trigger_name):
+    """sqlite3 authorizer that only lets SQLite prepare reads."""
+    if action in READ_ONLY_ACTIONS:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_PRAGMA and arg1.lower() in READ_ONLY_PRAGMAS:
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+@lru_cache(maxsize=8)
+def get_engine(database_url: str) -> Engine:
+    """Return the shared SQLAlchemy engine (and connection pool) for a URL."""
+    is_sqlite = database_url.startswith("sqlite")
+    engine = create_engine(
+        database_url,
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        poolclass=QueuePool,
+        pool_size=5,
+        max_overflow=10,
+    )
     
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    if is_sqlite:
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+            cursor.close()
+        
+        # Connections checked out read-only go back to the pool writable
+        @event.listens_for(engine, "checkin")
+        def _clear_authorizer(dbapi_connection, connection_record):
+            if dbapi_connection is not None:
+                dbapi_connection.set_authorizer(None)
     
-    # Create sales_people table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sales_people (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            region TEXT NOT NULL,
-            hire_date DATE NOT NULL,
-            quota REAL NOT NULL
-        )
-    """)
+    return engine
+
+
+@lru_cache(maxsize=8)
+def get_read_only_engine(database_url: str) -> Engine:
+    """Return a read-only view of the shared engine for a SQLite URL.
+
+    It draws from ``get_engine``'s connection pool, but every connection
+    checked out through it gets an authorizer (see ``READ_ONLY_ACTIONS``), so
+    SQLite refuses to even prepare a write. Unlike ``PRAGMA query_only``, no
+    SQL statement can turn that off.
+    """
+    if not database_url.startswith("sqlite"):
+        raise ValueError("Read-only engines are only supported for SQLite")
     
-    # Create sales table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sales (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sales_person_id INTEGER NOT NULL,
-            sale_date DATE NOT NULL,
-            amount REAL NOT NULL,
-            product_category TEXT NOT NULL,
-            customer_name TEXT NOT NULL,
-            FOREIGN KEY (sales_person_id) REFERENCES sales_people(id)
-        )
-    """)
+    engine = get_engine(database_url).execution_options()
     
-    # Check if data already exists
-    cursor.execute("SELECT COUNT(*) FROM sales_people")
-    if cursor.fetchone()[0] == 0:
-        # Insert sample sales people
-        sales_people = [
-            ("Alice Johnson", "alice.johnson@company.com", "North", "2022-01-15", 100000.0),
-            ("Bob Smith", "bob.smith@company.com", "South", "2022-03-20", 120000.0),
-            ("Carol Williams", "carol.williams@company.com", "East", "2021-11-10", 95000.0),
-            ("David Brown", "david.brown@company.com", "West", "2023-02-01", 110000.0),
-            ("Eva Davis", "eva.davis@company.com", "North", "2022-07-15", 105000.0),
-            ("Frank Miller", "frank.miller@company.com", "South", "2021-09-05", 115000.0),
-            ("Grace Wilson", "grace.wilson@company.com", "East", "2023-01-10", 98000.0),
-            ("Henry Moore", "henry.moore@company.com", "West", "2022-05-22", 125000.0),
-        ]
-        
-        cursor.executemany("""
-            INSERT INTO sales_people (name, email, region, hire_date, quota)
-            VALUES (?, ?, ?, ?, ?)
-        """, sales_people)
+    @event.listens_for(engine, "engine_connect")
+    def _deny_writes(connection):
+        connection.connection.driver_connection.set_authorizer(_read_only_authorizer)
+    
+    return engine
+
+
+def init_database(database_url: str = "sqlite:///./sales.db") -> None:
+    """Initialize SQLite database with sales data."""
+    # Ensure directory exists
+    db_path = get_database_path(database_url)
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    
+    # Create schema and load sample data in a single write transaction on
+    # the shared engine, so init and the agent use the same connection pool
+    engine = get_engine(database_url)
+    with engine.begin() as conn:
+        # Create sales_people table
+        conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS sales_people (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                region TEXT NOT NULL,
+                hire_date DATE NOT NULL,
+                quota REAL NOT NULL
+            )
+        """)
         
-        # Get sales person IDs
-        cursor.execute("SELECT id FROM sales_people")
-        sales_person_ids = [row[0] for row in cursor.fetchall()]
+        # Create sales table
+        conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS sales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sales_person_id INTEGER NOT NULL,
+                sale_date DATE NOT NULL,
+                amount REAL NOT NULL,
+                product_category TEXT NOT NULL,
+                customer_name TEXT NOT NULL,
+                FOREIGN KEY (sales_person_id) REFERENCES sales_people(id)
+            )
+        """)
         
-        # Generate sales data for the last 90 days
-        product_categories = ["Electronics", "Clothing", "Food", "Furniture", "Books", "Toys"]
-        customer_names = [
-            "Acme Corp", "Tech Solutions", "Global Industries", "Mega Store",
-            "City Retail", "Prime Services", "Elite Group", "Super Market",
-            "Best Buy Co", "Top Shelf Inc", "Quality Goods", "Premium Brands"
-        ]
+        # Covering indexes for the date filters and per-person / per-category
+        # roll-ups the agent typically generates
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(sale_date)"
+        )
+        conn.exec_driver_sql("""
+            CREATE INDEX IF NOT EXISTS idx_sales_person_date
+            ON sales(sales_person_id, sale_date, amount)
+        """)
+        conn.exec_driver_sql("""
+            CREATE INDEX IF NOT EXISTS idx_sales_category
+            ON sales(product_category, sale_date, amount)
+        """)
         
-        sales_data = []
-        start_date = datetime.now() - timedelta(days=90)
+        # Daily roll-up of sales per person and category, so common aggregate
+        # questions can be answered without scanning the sales table
+        conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS sales_daily_rollup (
+                sale_date DATE NOT NULL,
+                sales_person_id INTEGER NOT NULL,
+                product_category TEXT NOT NULL,
+                total REAL NOT NULL,
+                cnt INTEGER NOT NULL,
+                PRIMARY KEY (sale_date, sales_person_id, product_category)
+            )
+        """)
+        conn.exec_driver_sql("""
+            CREATE INDEX IF NOT EXISTS idx_rollup_person_date
+            ON sales_daily_rollup(sales_person_id, sale_date)
+        """)
         
-        for day_offset in range(90):
-            sale_date = start_date + timedelta(days=day_offset)
+        # Check if data already exists
+        if conn.exec_driver_sql("SELECT COUNT(*) FROM sales_people").scalar() == 0:
+            # Insert sample sales people
+            sales_people = [
+                ("Alice Johnson", "alice.johnson@company.com", "North", "2022-01-15", 100000.0),
+                ("Bob Smith", "bob.smith@company.com", "South", "2022-03-20", 120000.0),
+                ("Carol Williams", "carol.williams@company.com", "East", "2021-11-10", 95000.0),
+                ("David Brown", "david.brown@company.com", "West", "2023-02-01", 110000.0),
+                ("Eva Davis", "eva.davis@company.com", "North", "2022-07-15", 105000.0),
+                ("Frank Miller", "frank.miller@company.com", "South", "2021-09-05", 115000.0),
+                ("Grace Wilson", "grace.wilson@company.com", "East", "2023-01-10", 98000.0),
+                ("Henry Moore", "henry.moore@company.com", "West", "2022-05-22", 125000.0),
+            ]
+            
+            conn.exec_driver_sql("""
+                INSERT INTO sales_people (name, email, region, hire_date, quota)
+                VALUES (?, ?, ?, ?, ?)
+            """, sales_people)
+            
+            # Get sales person IDs
+            sales_person_ids = [
+                row[0] for row in conn.exec_driver_sql("SELECT id FROM sales_people")
+            ]
+            
+            # Generate sales data for the last 90 days
+            product_categories = ["Electronics", "Clothing", "Food", "Furniture", "Books", "Toys"]
+            customer_names = [
+                "Acme Corp", "Tech Solutions", "Global Industries", "Mega Store",
+                "City Retail", "Prime Services", "Elite Group", "Super Market",
+                "Best Buy Co", "Top Shelf Inc", "Quality Goods", "Premium Brands"
+            ]
+            
+            # Draw every column for all 90 days in a handful of vectorized calls
+            rng = np.random.default_rng(42)
+            start_date = datetime.now() - timedelta(days=90)
+            
             # Generate 5-15 sales per day
-            num_sales = random.randint(5, 15)
+            sales_per_day = rng.integers(5, 16, size=90)
+            num_sales = int(sales_per_day.sum())
+            # One ISO date string per day (date.isoformat skips strftime's
+            # format parsing), repeated once per sale on that day
+            date_strs = [
+                (start_date + timedelta(days=day_offset)).date().isoformat()
+                for day_offset in range(90)
+            ]
+            sale_dates = np.repeat(date_strs, sales_per_day)
+            
+            sales_data = list(zip(
+                rng.choice(sales_person_ids, num_sales).tolist(),
+                sale_dates.tolist(),
+                np.round(rng.uniform(100.0, 5000.0, num_sales), 2).tolist(),
+                rng.choice(product_categories, num_sales).tolist(),
+                rng.choice(customer_names, num_sales).tolist(),
+            ))
             
-            for _ in range(num_sales):
-                sales_person_id = random.choice(sales_person_ids)
-                amount = round(random.uniform(100.0, 5000.0), 2)
-                product_category = random.choice(product_categories)
-                customer_name = random.choice(customer_names)
-                
-                sales_data.append((
-                    sales_person_id,
-                    sale_date.strftime("%Y-%m-%d"),
-                    amount,
-                    product_category,
-                    customer_name
-                ))
+            conn.exec_driver_sql("""
+                INSERT INTO sales (sales_person_id, sale_date, amount, product_category, customer_name)
+                VALUES (?, ?, ?, ?, ?)
+            """, sales_data)
         
-        cursor.executemany("""
-            INSERT INTO sales (sales_person_id, sale_date, amount, product_category, customer_name)
-            VALUES (?, ?, ?, ?, ?)
-        """, sales_data)
+        # Rebuild the roll-up from the fact table, then keep it current on
+        # every insert, update and delete
+        conn.exec_driver_sql("DELETE FROM sales_daily_rollup")
+        conn.exec_driver_sql("""
+            INSERT INTO sales_daily_rollup
+                (sale_date, sales_person_id, product_category, total, cnt)
+            SELECT sale_date, sales_person_id, product_category, SUM(amount), COUNT(*)
+            FROM sales
+            GROUP BY sale_date, sales_person_id, product_category
+        """)
+        conn.exec_driver_sql("""
+            CREATE TRIGGER IF NOT EXISTS trg_sales_daily_rollup
+            AFTER INSERT ON sales
+            BEGIN
+                INSERT INTO sales_daily_rollup
+                    (sale_date, sales_person_id, product_category, total, cnt)
+                VALUES (NEW.sale_date, NEW.sales_person_id, NEW.product_category, NEW.amount, 1)
+                ON CONFLICT (sale_date, sales_person_id, product_category)
+                DO UPDATE SET total = total + excluded.total, cnt = cnt + 1;
+            END
+        """)
+        conn.exec_driver_sql("""
+            CREATE TRIGGER IF NOT EXISTS trg_sales_daily_rollup_delete
+            AFTER DELETE ON sales
+            BEGIN
+                UPDATE sales_daily_rollup
+                SET total = total - OLD.amount, cnt = cnt - 1
+                WHERE sale_date = OLD.sale_date
+                  AND sales_person_id = OLD.sales_person_id
+                  AND product_category = OLD.product_category;
+                DELETE FROM sales_daily_rollup
+                WHERE sale_date = OLD.sale_date
+                  AND sales_person_id = OLD.sales_person_id
+                  AND product_category = OLD.product_category
+                  AND cnt <= 0;
+            END
+        """)
+        # An update moves the old row out of its group and the new row into its own
+        conn.exec_driver_sql("""
+            CREATE TRIGGER IF NOT EXISTS trg_sales_daily_rollup_update
+            AFTER UPDATE OF sale_date, sales_person_id, product_category, amount ON sales
+            BEGIN
+                UPDATE sales_daily_rollup
+                SET total = total - OLD.amount, cnt = cnt - 1
+                WHERE sale_date = OLD.sale_date
+                  AND sales_person_id = OLD.sales_person_id
+                  AND product_category = OLD.product_category;
+                DELETE FROM sales_daily_rollup
+                WHERE sale_date = OLD.sale_date
+                  AND sales_person_id = OLD.sales_person_id
+                  AND product_category = OLD.product_category
+                  AND cnt <= 0;
+                INSERT INTO sales_daily_rollup
+                    (sale_date, sales_person_id, product_category, total, cnt)
+                VALUES (NEW.sale_date, NEW.sales_person_id, NEW.product_category, NEW.amount, 1)
+                ON CONFLICT (sale_date, sales_person_id, product_category)
+                DO UPDATE SET total = total + excluded.total, cnt = cnt + 1;
+            END
+        """)
+        
+        # Refresh planner statistics so the indexes above get picked
+        conn.exec_driver_sql("ANALYZE")
     
-    conn.commit()
-    conn.close()
     print(f"Database initialized at {db_path}")
 
 
+@lru_cache(maxsize=16)
 def get_database_path(database_url: str) -> str:
     """Extract file path from SQLite database URL."""
-    # Handle sqlite:///./sales.db or sqlite:///sales.db or sqlite:///./data/sales.db
-    if database_url.startswith("sqlite:///"):
-        path = database_url.replace("sqlite:///", "")
-        # Handle relative paths
-        if path.startswith("./"):
-            return path
-        # If no ./ prefix, add it for relative path
-        if not path.startswith("/"):
-            return f"./{path}"
+    # Handle sqlite:///./sales.db or sqlite:///sales.db or sqlite:///./data/sales.db,
+    # plus absolute paths written as sqlite:////abs/path/sales.db
+    parsed = urlparse(database_url)
+    if parsed.scheme != "sqlite":
+        return database_url
+    # Drop the slash that separates the (empty) host from the path
+    path = parsed.path[1:] if parsed.path.startswith("/") else parsed.path
+    # If no ./ prefix, add it for relative path
+    if os.path.isabs(path) or path.startswith("./"):
         return path
-    return database_url
-
+    return f"./{path}"
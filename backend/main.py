@@ -1,20 +1,27 @@
 """FastAPI backend for SQL Agent."""
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import Optional
+from sse_starlette.sse import EventSourceResponse
+from logging.handlers import QueueListener
+from typing import Any, Optional
+import asyncio
+import importlib
 import os
+import traceback
 
-from config import settings
-from database import init_database, get_database_path
-from agent import create_sql_agent_executor, query_database
+import orjson
+
+from config import HOT
+from database import init_database
 
 app = FastAPI(title="SQL Agent API", version="1.0.0")
 
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.cors_origins,
+    allow_origins=HOT.cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -23,10 +30,36 @@ app.add_middleware(
 # Global agent executor (initialized on startup)
 agent_executor: Optional[object] = None
 
+# What /query calls: the single-call fast path in front of the batched agent
+query_agent: Optional[object] = None
+
+# The single-call fast path on its own, tried first by /query/stream
+fast_agent: Optional[object] = None
+
+# Background thread that writes agent log records (started on startup)
+log_listener: Optional[QueueListener] = None
+
+# Background task that loads LangChain and builds the agents
+init_task: Optional[asyncio.Task] = None
+init_error: Optional[str] = None
+
+# Caps outstanding agent runs so a burst of requests can't exhaust the LLM rate limit
+query_semaphore = asyncio.Semaphore(HOT.max_concurrent_queries)
+
 
 class QueryRequest(BaseModel):
     """Request model for SQL queries."""
     query: str
+    include_steps: bool = False  # return the agent's tool calls with the answer
+    session_id: Optional[str] = None  # questions sharing one may be batched together
+
+
+class AgentStep(BaseModel):
+    """A single tool call made by the agent."""
+    tool: str
+    tool_input: Any
+    log: str
+    observation: str
 
 
 class QueryResponse(BaseModel):
@@ -34,7 +67,7 @@ class QueryResponse(BaseModel):
     success: bool
     result: Optional[str] = None
     error: Optional[str] = None
-    intermediate_steps: Optional[list] = None
+    intermediate_steps: Optional[list[AgentStep]] = None
 
 
 class ConfigResponse(BaseModel):
@@ -45,22 +78,67 @@ class ConfigResponse(BaseModel):
     openai_temperature: float
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database and agent on startup."""
-    global agent_executor
-    
-    # Initialize database
-    db_path = get_database_path(settings.database_url)
-    init_database(db_path)
+async def init_agent():
+    """Initialize database and agent.
+
+    The agent module pulls in LangChain and the OpenAI client, which takes
+    seconds to import, so it is imported here (off the event loop) rather
+    than at module level.
+    """
+    global agent_executor, query_agent, fast_agent, log_listener, init_error
     
-    # Create agent executor
     try:
-        agent_executor = create_sql_agent_executor(settings.database_url)
+        agent = await asyncio.to_thread(importlib.import_module, "agent")
+        log_listener = agent.configure_agent_logging()
+        
+        # Initialize database
+        await asyncio.to_thread(init_database, HOT.database_url)
+        
+        # Create agent executor
+        executor = await asyncio.to_thread(agent.create_sql_agent_executor, HOT.database_url)
+        # A batch shares one agent run's iteration budget, so keep it to
+        # roughly two tool steps per question to avoid hitting the cap
+        batched = agent.BatchedAgent(
+            executor,
+            max_batch=min(HOT.max_batch_size, max(1, HOT.max_agent_iters // 2)),
+            batch_window_ms=HOT.batch_window_ms,
+        )
+        query_agent = batched
+        # The fast path needs a connection SQLite keeps read-only
+        if HOT.fast_sql_enabled and HOT.database_url.startswith("sqlite"):
+            fast_agent = agent.create_fast_sql_agent(HOT.database_url, fallback=batched)
+            query_agent = fast_agent
+        agent_executor = executor
         print("SQL Agent initialized successfully")
     except Exception as e:
-        print(f"Error initializing SQL Agent: {e}")
-        raise
+        # Keep the error so /health reports it instead of staying "healthy"
+        init_error = f"{type(e).__name__}: {e}"
+        print(f"Error initializing SQL Agent: {init_error}")
+        traceback.print_exc()
+        return
+    
+    # Pay for DNS/TLS setup now rather than on the first /query
+    await agent.warm_up_llm()
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Start initializing the agent without blocking startup.
+
+    The server accepts requests (e.g. /health probes) right away; /query
+    returns 503 until ``agent_initialized`` turns true.
+    """
+    global init_task
+    init_task = asyncio.create_task(init_agent())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop any unfinished initialization and flush pending agent log records."""
+    if init_task is not None and not init_task.done():
+        init_task.cancel()
+    if log_listener is not None:
+        log_listener.stop()
 
 
 @app.get("/")
@@ -71,7 +149,16 @@ async def root():
 
 @app.get("/health")
 async def health():
-    """Health check endpoint."""
+    """Health check endpoint.
+
+    Returns 503 once agent initialization has failed; it will not recover
+    without a restart.
+    """
+    if init_error is not None:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "error", "agent_initialized": False, "error": init_error},
+        )
     return {"status": "healthy", "agent_initialized": agent_executor is not None}
 
 
@@ -79,10 +166,10 @@ async def health():
 async def get_config():
     """Get current configuration."""
     return ConfigResponse(
-        database_url=settings.database_url,
-        llm_provider=settings.llm_provider,
-        openai_model=settings.openai_model,
-        openai_temperature=settings.openai_temperature
+        database_url=HOT.database_url,
+        llm_provider=HOT.llm_provider,
+        openai_model=HOT.openai_model,
+        openai_temperature=HOT.openai_temperature
     )
 
 
@@ -90,16 +177,16 @@ async def get_config():
 async def debug_env():
     """Debug endpoint to check environment variables (API key masked)."""
     import os
-    api_key = settings.openai_api_key or os.getenv("OPENAI_API_KEY", "NOT_SET")
+    api_key = HOT.openai_api_key or os.getenv("OPENAI_API_KEY", "NOT_SET")
     api_key_display = f"{api_key[:10]}..." if api_key and api_key != "NOT_SET" and len(api_key) > 10 else "NOT_SET"
     
     return {
         "openai_api_key_from_settings": api_key_display,
         "openai_api_key_set": bool(api_key and api_key != "NOT_SET"),
-        "openai_base_url": settings.openai_base_url,
-        "openai_model": settings.openai_model,
+        "openai_base_url": HOT.openai_base_url,
+        "openai_model": HOT.openai_model,
         "env_openai_api_key": "SET" if os.getenv("OPENAI_API_KEY") else "NOT_SET",
-        "settings_openai_api_key": "SET" if settings.openai_api_key else "NOT_SET"
+        "settings_openai_api_key": "SET" if HOT.openai_api_key else "NOT_SET"
     }
 
 
@@ -109,16 +196,34 @@ async def execute_query(request: QueryRequest):
     if agent_executor is None:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
+    # Already imported by init_agent, so this is a sys.modules lookup
+    from agent import query_cache, query_database
+    
     if not request.query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
     
-    result = query_database(agent_executor, request.query)
+    # Serve cache hits without queueing behind in-flight agent runs
+    result = query_cache.get(HOT.database_url, request.query)
+    if result is None:
+        try:
+            # The timeout covers waiting for a slot as well as the run itself
+            async with asyncio.timeout(HOT.query_timeout):
+                async with query_semaphore:
+                    result = await query_database(
+                        query_agent,
+                        request.query,
+                        HOT.database_url,
+                        session_id=request.session_id,
+                    )
+        except TimeoutError:
+            raise HTTPException(status_code=504, detail="Query timed out")
     
     if result["success"]:
         return QueryResponse(
             success=True,
             result=result["result"],
-            intermediate_steps=result.get("intermediate_steps")
+            # Steps can be large; only serialize them when asked for
+            intermediate_steps=result.get("intermediate_steps") if request.include_steps else None
         )
     else:
         return QueryResponse(
@@ -127,7 +232,60 @@ async def execute_query(request: QueryRequest):
         )
 
 
+@app.post("/query/stream")
+async def stream_query_endpoint(request: QueryRequest):
+    """Execute a query and stream its progress as Server-Sent Events.
+
+    Emits ``token`` events as the LLM generates text, a ``step`` event for
+    each tool call as it completes, then a final ``result`` (or ``error``)
+    event. Each event's data is a JSON object. A cached answer is sent as a
+    single ``result`` event.
+    """
+    if agent_executor is None:
+        raise HTTPException(status_code=503, detail="Agent not initialized")
+    
+    from agent import query_cache, stream_query
+    
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    
+    cached = query_cache.get(HOT.database_url, request.query)
+    
+    async def produce(events: asyncio.Queue) -> None:
+        # The run (not the client reading the stream) holds the query slot and
+        # the timeout, which covers waiting for a slot as well as the run
+        try:
+            async with asyncio.timeout(HOT.query_timeout):
+                async with query_semaphore:
+                    async for event in stream_query(
+                        agent_executor, request.query, HOT.database_url, fast_agent=fast_agent
+                    ):
+                        events.put_nowait(event)
+        except TimeoutError:
+            events.put_nowait({"type": "error", "success": False, "error": "Query timed out"})
+        finally:
+            events.put_nowait(None)
+    
+    async def generate():
+        if cached is not None:
+            result = {"success": cached["success"], "result": cached["result"]}
+            yield {"event": "result", "data": orjson.dumps(result, default=str).decode()}
+            return
+        
+        events: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.create_task(produce(events))
+        try:
+            while (event := await events.get()) is not None:
+                event_type = event.pop("type")
+                yield {"event": event_type, "data": orjson.dumps(event, default=str).decode()}
+        finally:
+            # Client went away: stop the run and free its slot
+            producer.cancel()
+    
+    return EventSourceResponse(generate())
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=settings.api_host, port=settings.api_port)
+    uvicorn.run(app, host=HOT.api_host, port=HOT.api_port)
 
@@ -4,6 +4,17 @@ import './App.css'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
+// Parse one Server-Sent Events frame into its event name and data
+const parseEvent = (frame) => {
+  let event = 'message'
+  const data = []
+  for (const line of frame.split(/\r?\n/)) {
+    if (line.startsWith('event:')) event = line.slice(6).trim()
+    else if (line.startsWith('data:')) data.push(line.slice(5).trimStart())
+  }
+  return { event, data: data.join('\n') }
+}
+
 function App() {
   const [query, setQuery] = useState('')
   const [results, setResults] = useState([])
@@ -40,29 +51,65 @@ function App() {
     }
   }
 
+  const updateResult = (id, changes) => {
+    setResults(prev => prev.map(result => (result.id === id ? { ...result, ...changes } : result)))
+  }
+
   const handleSubmit = async (e) => {
     e.preventDefault()
     if (!query.trim()) return
 
+    const id = Date.now()
     setLoading(true)
+    setResults(prev => [{
+      id,
+      query,
+      result: '',
+      success: true,
+      error: null,
+      timestamp: new Date().toLocaleTimeString()
+    }, ...prev])
+
     try {
-      const response = await axios.post(`${API_URL}/query`, { query })
-      setResults(prev => [{
-        query,
-        result: response.data.result,
-        success: response.data.success,
-        error: response.data.error,
-        timestamp: new Date().toLocaleTimeString()
-      }, ...prev])
-      setQuery('')
+      // Stream Server-Sent Events so the answer shows up as it is generated
+      const response = await fetch(`${API_URL}/query/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ query })
+      })
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}))
+        throw new Error(body.detail || `Request failed with status ${response.status}`)
+      }
+
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+      let buffer = ''
+      let streamed = ''
+      let failed = false
+      while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += value
+        const frames = buffer.split(/\r?\n\r?\n/)
+        buffer = frames.pop()
+        for (const frame of frames) {
+          const { event, data } = parseEvent(frame)
+          if (!data) continue
+          const payload = JSON.parse(data)
+          if (event === 'token') {
+            streamed += payload.content
+            updateResult(id, { result: streamed })
+          } else if (event === 'result') {
+            updateResult(id, { result: payload.result })
+          } else if (event === 'error') {
+            failed = true
+            updateResult(id, { success: false, error: payload.error })
+          }
+        }
+      }
+      if (!failed) setQuery('')
     } catch (error) {
-      setResults(prev => [{
-        query,
-        result: null,
-        success: false,
-        error: error.response?.data?.detail || error.message,
-        timestamp: new Date().toLocaleTimeString()
-      }, ...prev])
+      updateResult(id, { success: false, error: error.message })
     } finally {
       setLoading(false)
     }
@@ -158,7 +205,7 @@ function App() {
             </div>
           ) : (
             results.map((result, idx) => (
-              <div key={idx} className={`result-card ${result.success ? 'success' : 'error'}`}>
+              <div key={result.id} className={`result-card ${result.success ? 'success' : 'error'}`}>
                 <div className="result-header">
                   <span className="timestamp">{result.timestamp}</span>
                   <span className={`status ${result.success ? 'success' : 'error'}`}>